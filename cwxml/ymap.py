@@ -492,7 +492,7 @@ class BoxOccludersList(ListPropertyRequired):
 class OccludeModel(ElementTree):
     class VertsProperty(ElementProperty):
         """Same as a TextProperty but formats the input and output and returns an empty element rather than None"""
-        value_types = (bytes)
+        value_types = (bytes, bytearray)
 
         def __init__(self, tag_name: str = "verts", value=None):
             super().__init__(tag_name, value or b"")
@@ -234,7 +234,7 @@ class SOLLUMZ_OT_export_assets(bpy.types.Operator, TimedOperator):
                         success = export_ydr(obj, filepath)
                     elif obj.sollum_type == SollumType.DRAWABLE_DICTIONARY:
                         filepath = self.get_filepath(obj, YDD.file_extension)
-                        success = export_ydd(obj, filepath)
+                        success = export_ydd(obj, filepath, export_settings)
                     elif obj.sollum_type == SollumType.FRAGMENT:
                         filepath = self.get_filepath(obj, YFT.file_extension)
                         success = export_yft(obj, filepath)
@@ -246,7 +246,7 @@ class SOLLUMZ_OT_export_assets(bpy.types.Operator, TimedOperator):
                         success = export_ybn(obj, filepath)
                     elif obj.sollum_type == SollumType.YMAP:
                         filepath = self.get_filepath(obj, YMAP.file_extension)
-                        success = export_ymap(obj, filepath)
+                        success = export_ymap(obj, filepath, export_settings)
                     else:
                         continue
 
@@ -3,6 +3,7 @@ import bpy
 import bmesh
 from mathutils import Matrix, Vector
 from typing import Optional, Tuple
+from collections import defaultdict
 
 from ..sollumz_properties import SOLLUMZ_UI_NAMES, LODLevel, SollumzGame
 
@@ -244,6 +245,18 @@ def get_children_recursive(obj) -> list[bpy.types.Object]:
     return children
 
 
+def build_children_map() -> defaultdict[bpy.types.Object, list[bpy.types.Object]]:
+    """Map each object to its direct children in a single pass over ``bpy.data.objects``.
+    ``Object.children`` iterates all objects in the file on every access, so prefer this when looking up the
+    children of many objects.
+    """
+    children_map = defaultdict(list)
+    for obj in bpy.data.objects:
+        if obj.parent is not None:
+            children_map[obj.parent].append(obj)
+    return children_map
+
+
 def get_object_with_children(obj):
     """Get the object including the whole child hierarchy"""
     objs = [obj]
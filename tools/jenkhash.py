@@ -1,3 +1,5 @@
+import functools
+
 
 def GenerateData(bts: bytes, seed=0):
     h = seed
@@ -30,6 +32,7 @@ def GenerateCaseSensitive(text, encoding="utf-8", seed=0):
     return GenerateData(bts, seed)
 
 
+@functools.lru_cache(maxsize=4096)
 def name_to_hash(name: str) -> int:
     """Gets a hash from a string. If it starts with `hash_`, it parses the hexadecimal number afterwards;
     otherwise, it calculates the JOAAT hash of the string.
@@ -41,6 +44,7 @@ def name_to_hash(name: str) -> int:
         return Generate(name)
 
 
+@functools.lru_cache(maxsize=4096)
 def name_to_hash_literal(name: str) -> int:
     """Gets a hash from a string. If it starts with `hash_`, it parses the hexadecimal number afterwards;
     otherwise, it calculates the case-sensitive JOAAT hash of the string.
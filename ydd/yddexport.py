@@ -1,5 +1,7 @@
 import bpy
-from typing import Optional
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Optional, Sequence
 from ..cwxml.drawable import DrawableDictionary, RDR2DrawableDictionary
 from ..cwxml.cloth import ClothDictionary
 from ..ydr.ydrexport import create_drawable_xml, write_embedded_textures
@@ -10,12 +12,17 @@ from ..ydr.cloth_diagnostics import (
 )
 from ..tools import jenkhash
 from ..sollumz_properties import SollumType, SollumzGame, import_export_current_game as current_game, set_import_export_current_game
-from ..sollumz_preferences import get_export_settings
+from ..sollumz_preferences import get_export_settings, SollumzExportSettings
 
 
-def export_ydd(ydd_obj: bpy.types.Object, filepath: Optional[str]) -> bool:
+def export_ydd(
+    ydd_obj: bpy.types.Object,
+    filepath: Optional[str],
+    export_settings: Optional[SollumzExportSettings] = None,
+) -> bool:
     """If filepath is None, a dry run is done and no files are written."""
-    export_settings = get_export_settings()
+    if export_settings is None:
+        export_settings = get_export_settings()
 
     with cloth_enter_export_context(ydd_obj):
         # Export a cloth dictionary .yld.xml if there is any cloth in the drawable dictionary
@@ -30,9 +37,30 @@ def export_ydd(ydd_obj: bpy.types.Object, filepath: Optional[str]) -> bool:
             yld_filepath = make_yld_filepath(filepath)
             yld_xml.write_xml(yld_filepath)
 
-        write_embedded_textures(ydd_obj, filepath)
-
-        ydd_xml.write_xml(filepath)
+        # Serialize the XML in a worker thread while the embedded textures are copied. Texture lookup accesses
+        # Blender data, which is not thread-safe, so it stays on the main thread. The XML is written to a
+        # temporary file and only moved into place once the textures are copied, so a failed export doesn't
+        # leave a new .ydd.xml behind.
+        tmp_filepath = filepath + ".tmp"
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            xml_future = executor.submit(ydd_xml.write_xml, tmp_filepath)
+            try:
+                write_embedded_textures(ydd_obj, filepath)
+            except BaseException:
+                if not xml_future.cancel():
+                    wait((xml_future,))
+                    if os.path.isfile(tmp_filepath):
+                        os.remove(tmp_filepath)
+                raise
+
+            try:
+                xml_future.result()
+            except BaseException:
+                if os.path.isfile(tmp_filepath):
+                    os.remove(tmp_filepath)
+                raise
+
+        os.replace(tmp_filepath, filepath)
     return True
 
 
@@ -43,14 +71,20 @@ def create_ydd_xml(
 ):
     set_import_export_current_game(ydd_obj.sollum_game_type)
 
-    if current_game() == SollumzGame.GTA:
+    game = current_game()
+    is_rdr = game == SollumzGame.RDR
+
+    if game == SollumzGame.GTA:
         ydd_xml = DrawableDictionary()
-    elif current_game() == SollumzGame.RDR:
+    elif is_rdr:
         ydd_xml = RDR2DrawableDictionary()
 
-    ydd_armature = find_ydd_armature(ydd_obj) if ydd_obj.type != "ARMATURE" else ydd_obj
+    drawables = ydd_xml.drawables if is_rdr else ydd_xml
+
+    ydd_children = ydd_obj.children
+    ydd_armature = find_ydd_armature(ydd_children) if ydd_obj.type != "ARMATURE" else ydd_obj
 
-    for child in ydd_obj.children:
+    for child in ydd_children:
         if child.sollum_type != SollumType.DRAWABLE:
             continue
 
@@ -59,7 +93,7 @@ def create_ydd_xml(
         else:
             armature_obj = None
 
-        if current_game() == SollumzGame.GTA and yld_xml is not None:
+        if game == SollumzGame.GTA and yld_xml is not None:
             from ..tools.blenderhelper import remove_number_suffix
             drawable_name = remove_number_suffix(child.name)
             cloth = next((c for c in yld_xml if c.name == drawable_name), None)
@@ -73,28 +107,23 @@ def create_ydd_xml(
         if exclude_skeleton or child.type != "ARMATURE":
             drawable_xml.skeleton = None
 
-        if current_game() == SollumzGame.GTA:
-            ydd_xml.append(drawable_xml)
-        elif current_game() == SollumzGame.RDR:
-            ydd_xml.drawables.append(drawable_xml)
+        drawables.append(drawable_xml)
 
-    if current_game() == SollumzGame.GTA:
-        ydd_xml.sort(key=get_hash)
-    elif current_game() == SollumzGame.RDR:
-        ydd_xml.drawables.sort(key=rdr_get_hash_literal)
+    if is_rdr:
+        drawables.sort(key=rdr_get_hash_literal)
+    else:
+        drawables.sort(key=get_hash)
 
     return ydd_xml
 
 
-def find_ydd_armature(ydd_obj: bpy.types.Object):
-    """Find first drawable with an armature in ``ydd_obj``."""
-    for child in ydd_obj.children:
-        if child.type == "ARMATURE":
-            return child
+def find_ydd_armature(children: Sequence[bpy.types.Object]) -> Optional[bpy.types.Object]:
+    """Find first drawable with an armature in ``children`` of the drawable dictionary."""
+    return next((child for child in children if child.type == "ARMATURE"), None)
 
 
 def get_hash(item):
-    return jenkhash.name_to_hash(item.name.split(".")[0])
+    return jenkhash.name_to_hash(item.name.split(".", 1)[0])
 
 def rdr_get_hash_literal(item):
     return jenkhash.name_to_hash_literal(item.hash)
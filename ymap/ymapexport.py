@@ -1,119 +1,174 @@
 import bpy
-import re
-import math
 import numpy as np
-from mathutils import Vector
 from struct import pack
 from ..cwxml.ymap import *
 from binascii import hexlify
-from ..tools.blenderhelper import remove_number_suffix
+from typing import Optional
+from ..tools.blenderhelper import remove_number_suffix, build_children_map, get_evaluated_obj
 from ..tools.meshhelper import get_bound_center_from_bounds, get_extents
 from ..sollumz_properties import SOLLUMZ_UI_NAMES, SollumType
-from ..sollumz_preferences import get_export_settings
+from ..sollumz_preferences import get_export_settings, SollumzExportSettings
 from .. import logger
 from ..tools.ymaphelper import generate_ymap_extents
 
 
-def box_from_obj(obj):
-    box = BoxOccluder()
+def _quantize_boxes(
+    centers: np.ndarray,
+    dimensions: np.ndarray,
+    angles_z: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Quantize box occluder data to the fixed-point values stored in ymaps.
 
-    bbmin, bbmax = get_extents(obj)
-    center = get_bound_center_from_bounds(bbmin, bbmax)
-    dimensions = obj.dimensions
-
-    box.center_x = round(center.x * 4)
-    box.center_y = round(center.y * 4)
-    box.center_z = round(center.z * 4)
-
-    box.length = round(dimensions.x * 4)
-    box.width = round(dimensions.y * 4)
-    box.height = round(dimensions.z * 4)
+    :return: Quantized centers, dimensions and the ``sin_z``/``cos_z`` values
+    """
+    centers_q = np.rint(centers * 4).astype(np.int32)
+    dimensions_q = np.rint(dimensions * 4).astype(np.int32)
+    # Only Z-axis rotation is supported, so the direction vector (1, 0, 0) rotated around Z and scaled by 0.5
+    # is just (cos(z), sin(z)) * 0.5. Its X component goes to sin_z and its Y component to cos_z, as the
+    # importer expects
+    sin_q = np.rint(np.cos(angles_z) * 16383.5).astype(np.int16)
+    cos_q = np.rint(np.sin(angles_z) * 16383.5).astype(np.int16)
+    return centers_q, dimensions_q, sin_q, cos_q
+
+
+def boxes_from_objs(objs) -> list[BoxOccluder]:
+    """Create box occluders from ``objs``. Quantizes centers, dimensions and Z rotations of all ``objs`` at once.
+    Only Z-axis rotation is taken into account, objects are expected to have been validated by the caller.
+    """
+    num_boxes = len(objs)
+    if num_boxes == 0:
+        return []
 
-    dir = Vector((1, 0, 0))
-    dir.rotate(obj.rotation_euler)
-    dir *= 0.5
-    box.sin_z = round(dir.x * 32767)
-    box.cos_z = round(dir.y * 32767)
+    centers = np.empty((num_boxes, 3), dtype=np.float64)
+    dimensions = np.empty((num_boxes, 3), dtype=np.float64)
+    for i, obj in enumerate(objs):
+        bbmin, bbmax = get_extents(obj)
+        centers[i] = get_bound_center_from_bounds(bbmin, bbmax)
+        dimensions[i] = obj.dimensions
+    angles_z = np.fromiter((obj.rotation_euler.z for obj in objs), dtype=np.float64, count=num_boxes)
 
-    return box
+    centers_q, dimensions_q, sin_q, cos_q = _quantize_boxes(centers, dimensions, angles_z)
 
+    boxes = []
+    for center, dims, sin_z, cos_z in zip(centers_q.tolist(), dimensions_q.tolist(), sin_q.tolist(), cos_q.tolist()):
+        box = BoxOccluder()
+        box.center_x, box.center_y, box.center_z = center
+        box.length, box.width, box.height = dims
+        box.sin_z = sin_z
+        box.cos_z = cos_z
+        boxes.append(box)
 
-def triangulate_obj(obj):
-    """Convert mesh from n-polygons to triangles"""
-    bpy.context.view_layer.objects.active = obj
-    bpy.ops.object.mode_set(mode="EDIT")
-    bpy.ops.mesh.select_all(action="SELECT")
-    bpy.ops.mesh.quads_convert_to_tris()
-    bpy.ops.object.mode_set(mode="OBJECT")
+    return boxes
 
 
-def occlusion_model_obj_get_data_buffer(obj) -> bytes:
+def occlusion_model_obj_get_data_buffer(obj, mesh: Optional[bpy.types.Mesh] = None) -> bytearray:
     """
     For each vertex get its coordinates in global space (this way we don't need to apply transfroms) as 32-bit floats
-    and for each face get its indices as 8-bit integers. Then convert them to bytes and append them together.
+    and for each triangle get its indices as 8-bit integers. Then convert them to bytes and append them together.
 
+    :param mesh: Mesh to read the data from, defaults to ``obj.data``
     :return verts: Bytes buffer containing the vertex coordinates and face indices
-    :rtype bytes:
+    :rtype bytearray:
     """
     # TODO: should validate that the mesh is within <256 verts
-    mesh = obj.data
-    verts = np.array([obj.matrix_world @ v.co for v in mesh.vertices], dtype=np.float32)
-    indices = np.array([i for p in mesh.polygons for i in p.vertices], dtype=np.uint8)
-    return verts.tobytes() + indices.tobytes()
-
-
-def model_from_obj(obj):
-    triangulate_obj(obj)
+    if mesh is None:
+        mesh = obj.data
+    num_verts = len(mesh.vertices)
+    verts = np.empty(num_verts * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", verts)
+    verts = verts.reshape((num_verts, 3))
+
+    matrix_world = np.asarray(obj.matrix_world, dtype=np.float32)
+    verts = np.ascontiguousarray(verts @ matrix_world[:3, :3].T + matrix_world[:3, 3], dtype=np.float32)
+
+    mesh.calc_loop_triangles()
+    indices = np.empty(len(mesh.loop_triangles) * 3, dtype=np.uint32)
+    mesh.loop_triangles.foreach_get("vertices", indices)
+    indices = np.ascontiguousarray(indices, dtype=np.uint8)
+
+    # Write both arrays into a single preallocated buffer, so the output is only allocated once
+    verts_size = verts.nbytes
+    buffer = bytearray(verts_size + indices.nbytes)
+    view = memoryview(buffer)
+    view[:verts_size] = verts.view(np.uint8).ravel()
+    view[verts_size:] = indices
+    return buffer
+
+
+def model_from_obj(obj) -> Optional[OccludeModel]:
+    """Returns ``None`` if the evaluated mesh has too many vertices to be exported."""
+    # Read from a temporary evaluated mesh and take the triangles from its loop triangles, so the source mesh
+    # is left untouched and doesn't need to be triangulated beforehand
+    obj_eval = get_evaluated_obj(obj)
+    mesh = obj_eval.to_mesh()
+    try:
+        # Face indices are stored as 8-bit integers. Check the evaluated mesh, modifiers may add vertices
+        if len(mesh.vertices) > 256:
+            logger.warning(
+                f"Object {obj.name} has too many vertices and will be skipped. It can not have more than 256 vertices.")
+            return None
+
+        verts = occlusion_model_obj_get_data_buffer(obj, mesh)
+        num_verts_in_bytes = len(mesh.vertices) * 12
+        face_count = len(mesh.loop_triangles)
+    finally:
+        obj_eval.to_mesh_clear()
+    data_size = num_verts_in_bytes + face_count * 3
+    if __debug__:
+        assert len(verts) == data_size
 
     model = OccludeModel()
     model.bmin, model.bmax = get_extents(obj)
-    model.verts = occlusion_model_obj_get_data_buffer(obj)
-    model.num_verts_in_bytes = len(obj.data.vertices) * 12
-    face_count = len(obj.data.polygons)
+    model.verts = verts
+    model.num_verts_in_bytes = num_verts_in_bytes
     model.num_tris = face_count | 0x8000  # add float vertex format marker
-    model.data_size = len(model.verts)
+    model.data_size = data_size
     model.flags = obj.ymap_model_occl_properties.model_occl_flags
 
-    assert model.data_size == (model.num_verts_in_bytes + face_count * 3)
-
     return model
 
 
 def entity_from_obj(obj):
     # Removing " (not found)" suffix, created when importing ymaps while entity was not found in the view layer
-    obj.name = re.sub(" \(not found\)", "", obj.name.lower())
+    obj.name = obj.name.lower().replace(" (not found)", "")
 
+    entity_props = obj.entity_properties
     entity = Entity()
     entity.archetype_name = remove_number_suffix(obj.name)
-    entity.flags = int(obj.entity_properties.flags)
-    entity.guid = int(obj.entity_properties.guid)
-    entity.position = obj.location
-    entity.rotation = obj.rotation_euler.to_quaternion()
+    entity.flags = int(entity_props.flags)
+    entity.guid = int(entity_props.guid)
+    # Copy the location so the XML writer reads plain values instead of going through the object's RNA property
+    entity.position = obj.location.copy()
+    rotation = obj.rotation_euler.to_quaternion()
     if entity.type != "CMloInstanceDef":
-        entity.rotation.invert()
-    entity.scale_xy = obj.scale.x
-    entity.scale_z = obj.scale.z
-    entity.parent_index = int(obj.entity_properties.parent_index)
-    entity.lod_dist = obj.entity_properties.lod_dist
-    entity.child_lod_dist = obj.entity_properties.child_lod_dist
-    entity.lod_level = obj.entity_properties.lod_level.upper().replace("SOLLUMZ_", "")
-    entity.num_children = int(obj.entity_properties.num_children)
-    entity.priority_level = obj.entity_properties.priority_level.upper().replace("SOLLUMZ_", "")
-    if current_game() == SollumzGame.GTA:
-        entity.ambient_occlusion_multiplier = int(obj.entity_properties.ambient_occlusion_multiplier)
-        entity.artificial_ambient_occlusion = int(obj.entity_properties.artificial_ambient_occlusion)
-    entity.tint_value = int(obj.entity_properties.tint_value)
-    if current_game() == SollumzGame.RDR:
-        entity.blend_age_layer = int(obj.entity_properties.blend_age_layer)
-        entity.blend_age_dirt = int(obj.entity_properties.blend_age_dirt)
+        rotation.invert()
+    entity.rotation = rotation
+    scale = obj.scale
+    entity.scale_xy = scale.x
+    entity.scale_z = scale.z
+    entity.parent_index = int(entity_props.parent_index)
+    entity.lod_dist = entity_props.lod_dist
+    entity.child_lod_dist = entity_props.child_lod_dist
+    entity.lod_level = entity_props.lod_level.upper().replace("SOLLUMZ_", "")
+    entity.num_children = int(entity_props.num_children)
+    entity.priority_level = entity_props.priority_level.upper().replace("SOLLUMZ_", "")
+    game = current_game()
+    if game == SollumzGame.GTA:
+        entity.ambient_occlusion_multiplier = int(entity_props.ambient_occlusion_multiplier)
+        entity.artificial_ambient_occlusion = int(entity_props.artificial_ambient_occlusion)
+    entity.tint_value = int(entity_props.tint_value)
+    if game == SollumzGame.RDR:
+        entity.blend_age_layer = int(entity_props.blend_age_layer)
+        entity.blend_age_dirt = int(entity_props.blend_age_dirt)
 
     return entity
 
-def cargen_from_obj(obj):
+def cargen_from_obj(obj, orient_x: float, orient_y: float):
     cargen = CarGenerator()
-    cargen.position = obj.location
+    cargen.position = obj.location.copy()
 
-    cargen.orient_x, cargen.orient_y = calculate_cargen_orient(obj)
+    cargen.orient_x = orient_x
+    cargen.orient_y = orient_y
 
     cargen.perpendicular_length = obj.ymap_cargen_properties.perpendicular_length
     cargen.car_model = obj.ymap_cargen_properties.car_model
@@ -128,79 +183,102 @@ def cargen_from_obj(obj):
     return cargen
 
 
-def calculate_cargen_orient(obj):
+def calculate_cargen_orient(objs) -> tuple[np.ndarray, np.ndarray]:
+    """Calculate ``orient_x`` and ``orient_y`` of all car generator ``objs`` at once."""
     # *-1 because GTA likes to invert values
-    angle = obj.rotation_euler[2] * -1
-
-    return 5 * math.sin(angle), 5 * math.cos(angle)
+    angles = -np.fromiter((obj.rotation_euler[2] for obj in objs), dtype=np.float64, count=len(objs))
+
+    return 5 * np.sin(angles), 5 * np.cos(angles)
+
+
+def _export_entity_group(ymap_obj, group_children, ymap: CMapData):
+    for entity_obj in group_children:
+        ymap.entities.append(entity_from_obj(entity_obj))
+
+
+def _export_box_occluder_group(ymap_obj, group_children, ymap: CMapData):
+    ymap_obj.ymap_properties.content_flags_toggle.has_occl = True
+
+    box_objs = []
+    for box_obj in group_children:
+        rotation = box_obj.rotation_euler
+        if abs(rotation.x) > 0.01 or abs(rotation.y) > 0.01:
+            logger.error(
+                f"Box occluders only support Z-axis rotation. Skipping {box_obj.name} due to X/Y rotation.")
+            continue
+
+        if box_obj.sollum_type == SollumType.YMAP_BOX_OCCLUDER:
+            box_objs.append(box_obj)
+        else:
+            logger.warning(
+                f"Object {box_obj.name} will be skipped because it is not a {SOLLUMZ_UI_NAMES[SollumType.YMAP_BOX_OCCLUDER]} type.")
+
+    ymap.box_occluders.extend(boxes_from_objs(box_objs))
+
+
+def _export_model_occluder_group(ymap_obj, group_children, ymap: CMapData):
+    ymap_obj.ymap_properties.content_flags_toggle.has_occl = True
+
+    for model_obj in group_children:
+        if model_obj.sollum_type == SollumType.YMAP_MODEL_OCCLUDER:
+            model = model_from_obj(model_obj)
+            if model is not None:
+                ymap.occlude_models.append(model)
+        else:
+            logger.warning(
+                f"Object {model_obj.name} will be skipped because it is not a {SOLLUMZ_UI_NAMES[SollumType.YMAP_MODEL_OCCLUDER]} type.")
+
+
+def _export_car_generator_group(ymap_obj, group_children, ymap: CMapData):
+    cargen_objs = []
+    for cargen_obj in group_children:
+        rotation = cargen_obj.rotation_euler
+        if abs(rotation.x) > 0.01 or abs(rotation.y) > 0.01:
+            logger.error(
+                f"Car generators only support Z-axis rotation. Skipping {cargen_obj.name} due to X/Y rotation.")
+            continue
+        if cargen_obj.sollum_type == SollumType.YMAP_CAR_GENERATOR:
+            cargen_objs.append(cargen_obj)
+        else:
+            logger.warning(
+                f"Object {cargen_obj.name} will be skipped because it is not a {SOLLUMZ_UI_NAMES[SollumType.YMAP_CAR_GENERATOR]} type.")
+
+    orients_x, orients_y = calculate_cargen_orient(cargen_objs)
+    for cargen_obj, orient_x, orient_y in zip(cargen_objs, orients_x.tolist(), orients_y.tolist()):
+        ymap.car_generators.append(cargen_from_obj(cargen_obj, orient_x, orient_y))
+
+
+# Maps ymap group types to the export setting that excludes them and the function that exports their children.
+# TODO: physics_dictionaries
+# TODO: time cycle
+# TODO: lod ligths
+# TODO: distant lod lights
+_YMAP_GROUP_EXPORTERS = {
+    SollumType.YMAP_ENTITY_GROUP: ("ymap_exclude_entities", _export_entity_group),
+    SollumType.YMAP_BOX_OCCLUDER_GROUP: ("ymap_box_occluders", _export_box_occluder_group),
+    SollumType.YMAP_MODEL_OCCLUDER_GROUP: ("ymap_model_occluders", _export_model_occluder_group),
+    SollumType.YMAP_CAR_GENERATOR_GROUP: ("ymap_car_generators", _export_car_generator_group),
+}
+
+
+def ymap_from_object(obj, export_settings: Optional[SollumzExportSettings] = None):
+    ymap = CMapData()
 
+    if export_settings is None:
+        export_settings = get_export_settings()
+    group_exporters = {
+        group_type: export_group
+        for group_type, (exclude_setting, export_group) in _YMAP_GROUP_EXPORTERS.items()
+        if not getattr(export_settings, exclude_setting)
+    }
+    children_map = build_children_map()
 
-def ymap_from_object(obj):
-    ymap = CMapData()
+    for child in children_map[obj]:
+        export_group = group_exporters.get(child.sollum_type)
+        if export_group is None:
+            continue
 
-    export_settings = get_export_settings()
-
-    for child in obj.children:
-        # Entities
-        if export_settings.ymap_exclude_entities == False and child.sollum_type == SollumType.YMAP_ENTITY_GROUP:
-            for entity_obj in child.children:
-                ymap.entities.append(entity_from_obj(entity_obj))
-
-        # Box occluders
-        if export_settings.ymap_box_occluders == False and child.sollum_type == SollumType.YMAP_BOX_OCCLUDER_GROUP:
-            obj.ymap_properties.content_flags_toggle.has_occl = True
-
-            for box_obj in child.children:
-                rotation = box_obj.rotation_euler
-                if abs(rotation.x) > 0.01 or abs(rotation.y) > 0.01:
-                    logger.error(
-                        f"Box occluders only support Z-axis rotation. Skipping {box_obj.name} due to X/Y rotation.")
-                    continue
-
-                if box_obj.sollum_type == SollumType.YMAP_BOX_OCCLUDER:
-                    ymap.box_occluders.append(box_from_obj(box_obj))
-                else:
-                    logger.warning(
-                        f"Object {box_obj.name} will be skipped because it is not a {SOLLUMZ_UI_NAMES[SollumType.YMAP_BOX_OCCLUDER]} type.")
-
-        # Model occluders
-        if export_settings.ymap_model_occluders == False and child.sollum_type == SollumType.YMAP_MODEL_OCCLUDER_GROUP:
-            obj.ymap_properties.content_flags_toggle.has_occl = True
-
-            for model_obj in child.children:
-                if model_obj.sollum_type == SollumType.YMAP_MODEL_OCCLUDER:
-                    if len(model_obj.data.vertices) > 256:
-                        logger.warning(
-                            f"Object {model_obj.name} has too many vertices and will be skipped. It can not have more than 256 vertices.")
-                        continue
-
-                    ymap.occlude_models.append(
-                        model_from_obj(model_obj))
-                else:
-                    logger.warning(
-                        f"Object {model_obj.name} will be skipped because it is not a {SOLLUMZ_UI_NAMES[SollumType.YMAP_MODEL_OCCLUDER]} type.")
-
-        # TODO: physics_dictionaries
-
-        # TODO: time cycle
-
-        # Car generators
-        if export_settings.ymap_car_generators == False and child.sollum_type == SollumType.YMAP_CAR_GENERATOR_GROUP:
-            for cargen_obj in child.children:
-                rotation = cargen_obj.rotation_euler
-                if abs(rotation.x) > 0.01 or abs(rotation.y) > 0.01:
-                    logger.error(
-                        f"Car generators only support Z-axis rotation. Skipping {cargen_obj.name} due to X/Y rotation.")
-                    continue
-                if cargen_obj.sollum_type == SollumType.YMAP_CAR_GENERATOR:
-                    ymap.car_generators.append(cargen_from_obj(cargen_obj))
-                else:
-                    logger.warning(
-                        f"Object {cargen_obj.name} will be skipped because it is not a {SOLLUMZ_UI_NAMES[SollumType.YMAP_CAR_GENERATOR]} type.")
-
-        # TODO: lod ligths
-
-        # TODO: distant lod lights
+        export_group(obj, children_map[child], ymap)
 
     ymap.name = remove_number_suffix(obj.name)
     ymap.parent = obj.ymap_properties.parent
@@ -223,7 +301,7 @@ def ymap_from_object(obj):
     return ymap
 
 
-def export_ymap(obj: bpy.types.Object, filepath: str) -> bool:
-    ymap = ymap_from_object(obj)
+def export_ymap(obj: bpy.types.Object, filepath: str, export_settings: Optional[SollumzExportSettings] = None) -> bool:
+    ymap = ymap_from_object(obj, export_settings)
     ymap.write_xml(filepath)
     return True